@@ -6,14 +6,43 @@
 from fastapi import FastAPI, HTTPException, Depends, Security, UploadFile, File, Form
 from fastapi.security import APIKeyHeader
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, BinaryIO
 from pathlib import Path
-import os, hashlib, secrets, tempfile, subprocess, zipfile, io, shutil
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import os, json, hashlib, hmac, tempfile, subprocess, zipfile, shutil, asyncio, posixpath
+import multiprocessing
 
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv(), override=False)
 
-app = FastAPI(title="Architecture Diagram Service", version="0.5.0")
+# Analysis tools, imported once and called in-process
+from app.tools import callgraph_ast, mermaid as mermaid_tool
+
+# Parse routes/callgraph JSON with the renderer's loader (orjson when available);
+# cache hits parse the full callgraph on every request
+_json_loads = mermaid_tool._json_loads
+
+# Process pool for CPU-bound analysis (AST walk, Mermaid rendering). Workers are
+# spawned rather than forked since the server process is multi-threaded.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS") or os.cpu_count() or 1)
+
+def _new_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS,
+                               mp_context=multiprocessing.get_context("spawn"))
+
+_POOL = _new_pool()
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await _locate_mmdc()
+    yield
+    await _mmdc_worker.close()
+    _POOL.shutdown(cancel_futures=True)
+
+app = FastAPI(title="Architecture Diagram Service", version="0.5.0", lifespan=lifespan)
 
 # --------------------------- Auth ---------------------------
 
@@ -23,13 +52,18 @@ api_key_header = APIKeyHeader(name=API_KEY_HEADER, auto_error=False)
 API_KEY_SHA256 = os.getenv("API_KEY_SHA256")
 if not API_KEY_SHA256:
     raise RuntimeError("Missing API_KEY_SHA256 env var")
+try:
+    # Raw 32-byte digest, so requests compare bytes without hex-encoding
+    _API_KEY_DIGEST = bytes.fromhex(API_KEY_SHA256)
+except ValueError:
+    raise RuntimeError("API_KEY_SHA256 must be a hex-encoded SHA256 digest")
 
 # Function to require and validate the API key
 def require_api_key(api_key: Optional[str] = Security(api_key_header)) -> None:
     if not api_key:
         raise HTTPException(401, "Missing API key", headers={"WWW-Authenticate": "ApiKey"})
-    digest = hashlib.sha256(api_key.encode()).hexdigest()
-    if not secrets.compare_digest(digest, API_KEY_SHA256):
+    digest = hashlib.sha256(api_key.encode()).digest()
+    if not hmac.compare_digest(digest, _API_KEY_DIGEST):
         raise HTTPException(401, "Invalid API key", headers={"WWW-Authenticate": "ApiKey"})
 
 # --------------------------- Paths --------------------------
@@ -38,15 +72,28 @@ APP_ROOT = Path(__file__).resolve().parent
 TOOLS_DIR = APP_ROOT / "tools"
 MERMAID_CONFIG = APP_ROOT / "mermaid.config.json"
 PUPPETEER_CONFIG = APP_ROOT / "puppeteer.json"
+MMDC_WORKER_JS = TOOLS_DIR / "mmdc_worker.mjs"
+
+# Subprocess environment, copied once at startup rather than per request
+_BASE_ENV = os.environ.copy()
+_INHERITED_PYTHONPATH = _BASE_ENV.get("PYTHONPATH", "")
+
+# --------------------------- Cache --------------------------
+
+# Analysis results (routes + callgraph) cached on disk, keyed by source fingerprint.
+# Bump TOOL_VERSION whenever tool output changes so stale entries are ignored.
+TOOL_VERSION = "1"
+CACHE_DIR = Path(os.getenv("DIAGRAM_CACHE_DIR") or (APP_ROOT / ".cache"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "200"))  # 0 disables the cache
 
 # -------------------------- Helpers -------------------------
 
-# Run a command, raise HTTPException on failure
-def _run(cmd: list[str], cwd: Path, env: dict | None = None) -> str:
+# Run a command and return its stdout, raise HTTPException on failure
+def _run_sync(cmd: list[str], cwd: Path, env: dict | None = None) -> str:
     try:
         res = subprocess.run(
             cmd, cwd=str(cwd), env=env, check=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace"
         )
         return res.stdout
     except subprocess.CalledProcessError as e:
@@ -56,26 +103,228 @@ def _run(cmd: list[str], cwd: Path, env: dict | None = None) -> str:
             f"Command failed: {' '.join(cmd)}\nSTDOUT:\n{e.stdout}\nSTDERR:\n{e.stderr}"
         )
 
-# Locate mmdc (Mermaid CLI) executable
-def _resolve_mmdc() -> str:
+# Run a command in a worker thread so the event loop stays free. A blocking
+# subprocess.run works on every event loop, including the selector loop that
+# uvicorn uses on Windows with --reload/--workers, which has no subprocess support.
+async def _run(cmd: list[str], cwd: Path, env: dict | None = None) -> str:
+    return await asyncio.to_thread(_run_sync, cmd, cwd, env)
+
+# Run a CPU-bound tool function in the analysis process pool. A pool whose worker
+# died (e.g. OOM-killed) stays broken for good, so swap in a fresh one and retry once.
+async def _in_pool(fn, *args, **kwargs):
+    global _POOL
+    loop = asyncio.get_running_loop()
+    call = partial(fn, *args, **kwargs)
+    pool = _POOL
+    try:
+        return await loop.run_in_executor(pool, call)
+    except BrokenProcessPool:
+        if _POOL is pool:  # first request to notice replaces it
+            _POOL = _new_pool()
+            pool.shutdown(wait=False, cancel_futures=True)
+        return await loop.run_in_executor(_POOL, call)
+
+# Cached mmdc path: None = not probed yet, "" = not found. Probed once at startup
+# and again only via /admin/reload, so SVG requests don't fork "mmdc -V" each time.
+_mmdc_exe: Optional[str] = None
+
+# Locate mmdc (Mermaid CLI) executable and cache the result
+async def _locate_mmdc() -> str:
+    global _mmdc_exe
     custom = os.getenv("MMDC_PATH")
     candidates = [c for c in [custom, "mmdc", "mmdc.cmd"] if c]
     appdata = os.environ.get("APPDATA")
     if appdata:
         candidates.append(os.path.join(appdata, "npm", "mmdc.cmd"))
+    # Probe into a local so concurrent requests keep the old path until we're done
+    found = ""
     for exe in candidates:
         try:
-            subprocess.run([exe, "-V"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True)
-            return exe
+            await _run([exe, "-V"], cwd=APP_ROOT)
+            found = exe
+            break
         except Exception:
             pass
-    raise HTTPException(500, "Mermaid CLI not found. Install with: npm i -g @mermaid-js/mermaid-cli "
-                             "or set MMDC_PATH to the full path of mmdc(.cmd).")
+    _mmdc_exe = found
+    return found
+
+# Return the cached mmdc path; the "not found" error is deferred to SVG requests
+async def _resolve_mmdc() -> str:
+    exe = _mmdc_exe if _mmdc_exe is not None else await _locate_mmdc()
+    if not exe:
+        raise HTTPException(500, "Mermaid CLI not found. Install with: npm i -g @mermaid-js/mermaid-cli "
+                                 "or set MMDC_PATH to the full path of mmdc(.cmd).")
+    return exe
+
+# Long-lived Node process (mmdc_worker.mjs) that keeps one headless browser warm,
+# so SVG renders skip the per-call Chrome launch of the mmdc CLI. Started on the
+# first SVG request; render() returns None whenever the worker is unavailable.
+class _MermaidWorker:
+    enabled = os.getenv("MMDC_WORKER", "1") == "1"
+    start_timeout = float(os.getenv("MMDC_WORKER_START_TIMEOUT", "60"))
+    render_timeout = float(os.getenv("MMDC_WORKER_TIMEOUT", "120"))
+
+    def __init__(self) -> None:
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.reader: Optional[asyncio.Task] = None
+        self.pending: dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self.failed = False  # startup failed; stay on the CLI until reset()
+        self.lock = asyncio.Lock()
+
+    # The reader finishes as soon as stdout closes, before the exit is reaped
+    def _alive(self) -> bool:
+        return (self.proc is not None and self.proc.returncode is None
+                and self.reader is not None and not self.reader.done())
 
-# Safely unzip bytes to a destination directory to prevent path traversal
-def _safe_unzip_to(zip_bytes: bytes, dest: Path) -> None:
+    # Spawn node and wait for the worker's ready line
+    async def _start(self) -> None:
+        node = shutil.which("node")
+        if not node or not MMDC_WORKER_JS.exists():
+            raise RuntimeError("node or mmdc_worker.mjs not available")
+        self.proc = await asyncio.create_subprocess_exec(
+            node, str(MMDC_WORKER_JS), str(MERMAID_CONFIG), str(PUPPETEER_CONFIG),
+            cwd=str(APP_ROOT), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            limit=1 << 28,  # one JSON line per SVG
+        )
+        try:
+            line = await asyncio.wait_for(self.proc.stdout.readline(), self.start_timeout)
+            if not json.loads(line or b"{}").get("ready"):
+                raise RuntimeError("mmdc worker failed to start")
+        except BaseException:
+            await self.close()
+            raise
+        # Each process gets its own pending map, so a dying worker's reader
+        # can't fail requests already sent to its replacement
+        self.pending = {}
+        self.reader = asyncio.create_task(self._read(self.proc, self.pending))
+
+    # Dispatch replies to waiting requests; fail them all if the worker exits
+    async def _read(self, proc: asyncio.subprocess.Process, pending: dict) -> None:
+        try:
+            while line := await proc.stdout.readline():
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue  # stray non-protocol output
+                if not isinstance(msg, dict):
+                    continue
+                fut = pending.pop(msg.get("id"), None)
+                if fut is not None and not fut.done():
+                    fut.set_result(msg)
+        finally:
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(RuntimeError("mmdc worker exited"))
+            pending.clear()
+
+    # Render Mermaid text to SVG; raises HTTPException if the diagram fails to render
+    async def render(self, mermaid_txt: str) -> Optional[str]:
+        if not self.enabled or self.failed:
+            return None
+        async with self.lock:
+            if not self._alive():
+                await self.close()  # reap a worker that died since the last request
+                try:
+                    await self._start()
+                except Exception:
+                    self.failed = True
+                    return None
+            # Register and send while holding the lock, so a concurrent close()
+            # can't swap self.proc out from under this request
+            proc, pending = self.proc, self.pending
+            req_id = self.next_id
+            self.next_id += 1
+            fut = asyncio.get_running_loop().create_future()
+            pending[req_id] = fut
+            try:
+                proc.stdin.write(json.dumps({"id": req_id, "definition": mermaid_txt}).encode() + b"\n")
+            except OSError:
+                pending.pop(req_id, None)
+                return None
+        try:
+            await proc.stdin.drain()
+            msg = await asyncio.wait_for(fut, self.render_timeout)
+        except asyncio.TimeoutError:
+            if self.proc is proc:
+                await self.close()  # wedged browser; restart on next request
+            raise HTTPException(500, f"SVG render timed out after {self.render_timeout:.0f}s")
+        except (OSError, RuntimeError):
+            return None
+        finally:
+            pending.pop(req_id, None)
+        if "error" in msg:
+            raise HTTPException(500, f"SVG render failed: {msg['error']}")
+        return msg["svg"]
+
+    # Stop the worker (closing stdin lets it shut the browser down cleanly)
+    async def close(self) -> None:
+        proc, self.proc = self.proc, None
+        reader, self.reader = self.reader, None
+        if proc is not None and proc.returncode is None:
+            proc.stdin.close()
+            try:
+                await asyncio.wait_for(proc.wait(), 10)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+        if reader is not None:
+            # A reader that died on its own must not fail the caller closing it
+            await asyncio.gather(reader, return_exceptions=True)
+
+    # Forget a failed start and stop any running worker
+    async def reset(self) -> None:
+        self.failed = False
+        await self.close()
+
+_mmdc_worker = _MermaidWorker()
+
+# Render SVG with the warm worker, falling back to a one-shot mmdc run.
+# Returns (svg, error); only a missing Mermaid CLI raises.
+async def _render_svg(mermaid_txt: str) -> tuple[Optional[str], Optional[str]]:
+    try:
+        svg_txt = await _mmdc_worker.render(mermaid_txt)
+    except HTTPException as e:
+        return None, e.detail
+    if svg_txt is not None:
+        return svg_txt, None
+
+    mmdc = await _resolve_mmdc()
+    with tempfile.TemporaryDirectory() as tmp:
+        mmd = Path(tmp) / "diagram.mmd"
+        svg = Path(tmp) / "diagram.svg"
+        mmd.write_text(mermaid_txt, encoding="utf-8")
+        cmd = [mmdc, "-i", str(mmd), "-o", str(svg), "-b", "transparent", "--scale", "1"]
+        if MERMAID_CONFIG.exists():
+            cmd += ["--configFile", str(MERMAID_CONFIG)]
+        if PUPPETEER_CONFIG.exists():
+            cmd += ["--puppeteerConfigFile", str(PUPPETEER_CONFIG)]
+        try:
+            await _run(cmd, cwd=APP_ROOT, env=_BASE_ENV)
+            return svg.read_text(encoding="utf-8"), None
+        except HTTPException as e:
+            return None, e.detail
+
+# Buffer size for streaming uploads/extraction
+COPY_BUFSIZE = 1 << 20
+
+# Hash a seekable file object in chunks, leaving it rewound
+def _sha256_fileobj(fobj: BinaryIO) -> str:
+    h = hashlib.sha256()
+    fobj.seek(0)
+    while chunk := fobj.read(COPY_BUFSIZE):
+        h.update(chunk)
+    fobj.seek(0)
+    return h.hexdigest()
+
+# Safely unzip a seekable file object to a destination directory to prevent path traversal
+def _safe_unzip_to(zip_fileobj: BinaryIO, dest: Path) -> None:
     dest.mkdir(parents=True, exist_ok=True)
-    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+    try:
+        zf = zipfile.ZipFile(zip_fileobj)
+    except zipfile.BadZipFile:
+        raise HTTPException(400, "Uploaded file is not a valid zip archive")
+    with zf:
         for member in zf.infolist():
             member_path = (dest / member.filename).resolve()
             if not str(member_path).startswith(str(dest.resolve())):
@@ -85,12 +334,122 @@ def _safe_unzip_to(zip_bytes: bytes, dest: Path) -> None:
             else:
                 member_path.parent.mkdir(parents=True, exist_ok=True)
                 with zf.open(member) as src, open(member_path, "wb") as out:
-                    shutil.copyfileobj(src, out)
+                    shutil.copyfileobj(src, out, length=COPY_BUFSIZE)
+
+# Start a cache key hash from the settings shared by every kind of key
+def _key_hash(scan_rel: str, app_module: Optional[str], prefix: str):
+    h = hashlib.sha256()
+    h.update(f"{TOOL_VERSION}\0{prefix}\0{app_module or ''}\0{scan_rel}\0".encode())
+    return h
+
+# List the member names of a seekable zip file object, leaving it rewound
+def _zip_names(zip_fileobj: BinaryIO) -> list[str]:
+    try:
+        with zipfile.ZipFile(zip_fileobj) as zf:
+            names = zf.namelist()
+    except zipfile.BadZipFile:
+        raise HTTPException(400, "Uploaded file is not a valid zip archive")
+    zip_fileobj.seek(0)
+    return names
+
+# Resolve the scan path inside a zip, relative to its root, the way _generate
+# does for an extracted tree. None means "can't tell without extracting":
+# _generate validates package_dir on the extracted tree and owns the 400.
+def _zip_scan_rel(names: list[str], package_dir: Optional[str], prefix: str) -> Optional[str]:
+    def has_dir(d: str) -> bool:
+        return any(n == d or n.startswith(d + "/") for n in names)
+    if package_dir:
+        rel = posixpath.normpath(package_dir.replace("\\", "/"))
+        if rel == ".":
+            return rel
+        return rel if has_dir(rel) else None
+    return prefix if has_dir(prefix) else "."
+
+# Scan path relative to the project root, as used in cache keys
+def _scan_rel(project_dir: Path, scan_path: Path) -> str:
+    try:
+        return scan_path.relative_to(project_dir).as_posix()
+    except ValueError:
+        return str(scan_path)
+
+# Directories never fingerprinted: installed packages, not project sources
+_KEY_SKIP_DIRS = {"site-packages", "node_modules", "__pycache__"}
+
+# Fingerprint the analysis inputs of a project directory by walking its .py files
+def _cache_key(
+    project_dir: Path,
+    scan_path: Path,
+    app_module: Optional[str],
+    prefix: str,
+) -> str:
+    h = _key_hash(_scan_rel(project_dir, scan_path), app_module, prefix)
+
+    # Route export imports the whole project, the callgraph only sees scan_path
+    root = project_dir if app_module else scan_path
+    h.update(f"{root}\0".encode())
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Prune dot-dirs and in-project environments so each key costs a stat
+        # per project file, not per installed package file
+        dirnames[:] = [d for d in dirnames
+                       if not d.startswith(".") and d not in _KEY_SKIP_DIRS
+                       and not os.path.exists(os.path.join(dirpath, d, "pyvenv.cfg"))]
+        for name in filenames:
+            if name.endswith(".py") and not name.startswith("."):
+                file = Path(dirpath, name)
+                st = file.stat()
+                files.append((file.relative_to(root).as_posix(), st.st_size, st.st_mtime_ns))
+    for rel, size, mtime_ns in sorted(files):
+        h.update(f"{rel}\0{size}\0{mtime_ns}\n".encode())
+    return h.hexdigest()
+
+# Fingerprint an uploaded archive by its content hash; no extraction needed
+def _upload_cache_key(scan_rel: str, app_module: Optional[str], prefix: str, content_key: str) -> str:
+    h = _key_hash(scan_rel, app_module, prefix)
+    h.update(content_key.encode())
+    return h.hexdigest()
+
+# Read cached (routes.json, callgraph.json) text for a key, or None on miss
+def _cache_load(key: str) -> Optional[tuple[str, str]]:
+    if CACHE_MAX_ENTRIES <= 0:
+        return None
+    entry = CACHE_DIR / key
+    try:
+        routes_txt = (entry / "routes.json").read_text(encoding="utf-8")
+        callgraph_txt = (entry / "callgraph.json").read_text(encoding="utf-8")
+        os.utime(entry)  # mark as recently used for LRU eviction
+    except OSError:
+        return None
+    return routes_txt, callgraph_txt
+
+# Atomically publish an entry, then evict least-recently-used ones past the limit
+def _cache_store(key: str, routes_txt: str, callgraph_txt: str) -> None:
+    if CACHE_MAX_ENTRIES <= 0:
+        return
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=".tmp-", dir=CACHE_DIR))
+        (staging / "routes.json").write_text(routes_txt, encoding="utf-8")
+        (staging / "callgraph.json").write_text(callgraph_txt, encoding="utf-8")
+        try:
+            os.replace(staging, CACHE_DIR / key)
+        except OSError:
+            # Another request published the same key first
+            shutil.rmtree(staging, ignore_errors=True)
+
+        entries = [p for p in CACHE_DIR.iterdir() if p.is_dir() and not p.name.startswith(".")]
+        if len(entries) > CACHE_MAX_ENTRIES:
+            entries.sort(key=lambda p: p.stat().st_mtime_ns)
+            for old in entries[:len(entries) - CACHE_MAX_ENTRIES]:
+                shutil.rmtree(old, ignore_errors=True)
+    except OSError:
+        # Cache is best-effort (e.g. read-only filesystem)
+        pass
 
 # --------------------------- Core ---------------------------
 
 # Main generation function
-def _generate(
+async def _generate(
     project_dir: Path,
     package_dir: Optional[str],
     app_module: Optional[str],
@@ -100,17 +459,11 @@ def _generate(
     graph_mode: str,
     max_hops: int,
     layout_dir: str,
+    content_key: Optional[str] = None,
 ) -> dict:
     if not project_dir.exists():
         raise HTTPException(400, f"project_dir does not exist: {project_dir}")
 
-    base_env = os.environ.copy()
-    base_env["PYTHONPATH"] = os.pathsep.join([
-        str(APP_ROOT),
-        str(project_dir),
-        base_env.get("PYTHONPATH", ""),
-    ])
-
     # Determine scan path
     if package_dir:
         scan_path = (project_dir / package_dir).resolve()
@@ -120,75 +473,97 @@ def _generate(
         maybe = project_dir / prefix
         scan_path = maybe if maybe.exists() else project_dir
 
-    with tempfile.TemporaryDirectory() as tmp:
-        tmp_path = Path(tmp)
-        routes_json = tmp_path / "routes.json"
-        callgraph_json = tmp_path / "callgraph.json"
+    if content_key:
+        key = _upload_cache_key(_scan_rel(project_dir, scan_path), app_module, prefix, content_key)
+    else:
+        key = await asyncio.to_thread(_cache_key, project_dir, scan_path, app_module, prefix)
+    cached = await asyncio.to_thread(_cache_load, key)
 
-        # 1) Export routes (optional)
+    if cached:
+        routes_txt, callgraph_txt = cached
+        routes = _json_loads(routes_txt)
+        callgraph = _json_loads(callgraph_txt)
+    else:
+        # 1) Export routes (optional). Stays a subprocess: it imports the target
+        #    project's app, which must not share sys.modules with this service.
         if app_module:
-            env = base_env.copy()
+            env = dict(_BASE_ENV)
+            env["PYTHONPATH"] = os.pathsep.join([str(APP_ROOT), str(project_dir), _INHERITED_PYTHONPATH])
             env["APP_MODULE"] = app_module
-            _run(["python", str(TOOLS_DIR / "export_routes.py"), "--out", str(routes_json)],
-                 cwd=project_dir, env=env)
+            # Written to a file, not stdout: the target app may print at exit
+            with tempfile.TemporaryDirectory() as tmp:
+                routes_json = Path(tmp) / "routes.json"
+                out = await _run(["python", str(TOOLS_DIR / "export_routes.py"), "--out", str(routes_json)],
+                                 cwd=project_dir, env=env)
+                try:
+                    routes_txt = await asyncio.to_thread(routes_json.read_text, encoding="utf-8")
+                    routes = _json_loads(routes_txt)
+                except (OSError, ValueError) as e:
+                    raise HTTPException(500, f"Route export produced no valid routes.json: {e!r}\nSTDOUT:\n{out}")
         else:
-            routes_json.write_text("[]", encoding="utf-8")
+            routes_txt = "[]"
+            routes = []
 
         # 2) Build callgraph fresh
-        _run([
-            "python", str(TOOLS_DIR / "callgraph_ast.py"),
-            str(scan_path), "--out", str(callgraph_json), "--prefix", prefix
-        ], cwd=project_dir, env=base_env)
-
-        # 3) Put inputs where mermaid.py expects them (APP_ROOT cwd)
-        service_routes = APP_ROOT / "routes.json"
-        service_callgraph = APP_ROOT / "callgraph.json"
-        service_routes.write_text(routes_json.read_text(encoding="utf-8"), encoding="utf-8")
-        service_callgraph.write_text(callgraph_json.read_text(encoding="utf-8"), encoding="utf-8")
-
-        # 3b) Generate Mermaid (SOFT-FAIL: return artifacts even if this fails)
-        mermaid_env = base_env.copy()
-        mermaid_env["MERMAID_MODE"] = graph_mode     # api | nhops | full
-        mermaid_env["MAX_HOPS"] = str(max_hops)
-        mermaid_env["MERMAID_DIR"] = layout_dir      # LR | RL | TD | TB | BT
-        mermaid_txt = None
-        mermaid_err = None
         try:
-            mermaid_txt = _run(["python", str(TOOLS_DIR / "mermaid.py")], cwd=APP_ROOT, env=mermaid_env)
-        except HTTPException as e:
-            mermaid_err = e.detail
-
-        resp = {}
-        if include_artifacts:
-            resp["artifacts"] = {
-                "routes.json": service_routes.read_text(encoding="utf-8"),
-                "callgraph.json": service_callgraph.read_text(encoding="utf-8"),
-            }
-
-        if mermaid_txt is not None:
-            resp["mermaid"] = mermaid_txt
-
-            # 4) Optional SVG (SOFT-FAIL)
-            if render == "svg":
-                mmd = tmp_path / "diagram.mmd"
-                svg = tmp_path / "diagram.svg"
-                mmd.write_text(mermaid_txt, encoding="utf-8")
-                mmdc = _resolve_mmdc()
-                cmd = [mmdc, "-i", str(mmd), "-o", str(svg), "-b", "transparent", "--scale", "1"]
-                if MERMAID_CONFIG.exists():
-                    cmd += ["--configFile", str(MERMAID_CONFIG)]
-                if PUPPETEER_CONFIG.exists():
-                    cmd += ["--puppeteerConfigFile", str(PUPPETEER_CONFIG)]
-                try:
-                    _run(cmd, cwd=APP_ROOT, env=base_env)
-                    resp.update({"svg": svg.read_text(encoding="utf-8"), "format": "svg"})
-                except HTTPException as e:
-                    resp["svg_error"] = e.detail
-        else:
-            # Mermaid failed, but we still return artifacts and a clear error
-            resp["mermaid_error"] = mermaid_err
+            callgraph = await _in_pool(callgraph_ast.build_callgraph, scan_path, prefix)
+        except Exception as e:
+            raise HTTPException(500, f"Callgraph build failed for {scan_path}: {e!r}")
+        callgraph_txt = json.dumps(callgraph, indent=2)
+
+        await asyncio.to_thread(_cache_store, key, routes_txt, callgraph_txt)
 
-        return resp
+    return await _respond(routes_txt, callgraph_txt, routes, callgraph,
+                          render, include_artifacts, graph_mode, max_hops, layout_dir)
+
+# Build the response from analysis results: artifacts, Mermaid and optional SVG
+async def _respond(
+    routes_txt: str,
+    callgraph_txt: str,
+    routes: list,
+    callgraph: dict,
+    render: str,
+    include_artifacts: bool,
+    graph_mode: str,
+    max_hops: int,
+    layout_dir: str,
+) -> dict:
+    # 3) Generate Mermaid (SOFT-FAIL: return artifacts even if this fails)
+    mermaid_txt = None
+    mermaid_err = None
+    try:
+        mermaid_txt = await _in_pool(
+            mermaid_tool.render_mermaid,
+            routes, callgraph,
+            mode=graph_mode,         # api | nhops | full
+            max_hops=max_hops,
+            direction=layout_dir,    # LR | RL | TD | TB | BT
+        )
+    except Exception as e:
+        mermaid_err = f"Mermaid generation failed: {e!r}"
+
+    resp = {}
+    if include_artifacts:
+        resp["artifacts"] = {
+            "routes.json": routes_txt,
+            "callgraph.json": callgraph_txt,
+        }
+
+    if mermaid_txt is not None:
+        resp["mermaid"] = mermaid_txt
+
+        # 4) Optional SVG (SOFT-FAIL)
+        if render == "svg":
+            svg_txt, svg_err = await _render_svg(mermaid_txt)
+            if svg_txt is not None:
+                resp.update({"svg": svg_txt, "format": "svg"})
+            else:
+                resp["svg_error"] = svg_err
+    else:
+        # Mermaid failed, but we still return artifacts and a clear error
+        resp["mermaid_error"] = mermaid_err
+
+    return resp
 
 # --------------------------- Models -------------------------
 class DiagramRequest(BaseModel):
@@ -209,10 +584,16 @@ class DiagramRequest(BaseModel):
 def health():
     return {"ok": True}
 
+# Re-probe external tools (e.g. after installing Mermaid CLI)
+@app.post("/admin/reload")
+async def admin_reload(_=Depends(require_api_key)):
+    await _mmdc_worker.reset()
+    return {"mmdc": await _locate_mmdc() or None}
+
 # Generate diagram from a live project directory
 @app.post("/api/diagram")
-def make_diagram(req: DiagramRequest, _=Depends(require_api_key)):
-    return _generate(
+async def make_diagram(req: DiagramRequest, _=Depends(require_api_key)):
+    return await _generate(
         project_dir=Path(req.project_dir).resolve(),
         package_dir=req.package_dir,
         app_module=req.app_module,
@@ -240,11 +621,24 @@ async def make_diagram_zip(
 ):
     if render not in ("mermaid", "svg"):
         raise HTTPException(422, "render must be 'mermaid' or 'svg'")
+    # Key the cache on the upload's hash so repeat uploads skip extraction entirely.
+    # Stream from the spooled upload file rather than reading it into memory.
+    content_key = await asyncio.to_thread(_sha256_fileobj, file.file)
+    names = await asyncio.to_thread(_zip_names, file.file)
+    scan_rel = _zip_scan_rel(names, package_dir, prefix)
+    cached = None
+    if scan_rel is not None:
+        key = _upload_cache_key(scan_rel, app_module, prefix, content_key)
+        cached = await asyncio.to_thread(_cache_load, key)
+    if cached:
+        routes_txt, callgraph_txt = cached
+        return await _respond(routes_txt, callgraph_txt, _json_loads(routes_txt), _json_loads(callgraph_txt),
+                              render, include_artifacts, graph_mode, max_hops, layout_dir)
+
     with tempfile.TemporaryDirectory() as tmp:
         proj_dir = Path(tmp) / "project"
-        zip_bytes = await file.read()
-        _safe_unzip_to(zip_bytes, proj_dir)
-        return _generate(
+        await asyncio.to_thread(_safe_unzip_to, file.file, proj_dir)
+        return await _generate(
             project_dir=proj_dir.resolve(),
             package_dir=package_dir,
             app_module=app_module,
@@ -254,5 +648,6 @@ async def make_diagram_zip(
             graph_mode=graph_mode,
             max_hops=max_hops,
             layout_dir=layout_dir,
+            content_key=content_key,
         )
 
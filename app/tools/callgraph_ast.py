@@ -176,21 +176,9 @@ def collect_defs(root: Path, pkg_root: Path) -> Set[str]:
                         defs.add(f"{mod}.{node.name}.{item.name}")
     return defs
 
-def main() -> int:
-    if len(sys.argv) < 2:
-        print("Usage: python tools/callgraph_ast.py <package_dir> [--out callgraph.json] [--prefix app]", file=sys.stderr)
-        return 2
-    src_dir = Path(sys.argv[1]).resolve()
-    out_path = Path("callgraph.json").resolve()
-    prefix = "app"
-    args = sys.argv[2:]
-    if "--out" in args:
-        i = args.index("--out")
-        out_path = Path(args[i+1]).resolve()
-    if "--prefix" in args:
-        i = args.index("--prefix")
-        prefix = args[i+1]
-
+# Build the project-local callgraph for a package directory
+def build_callgraph(src_dir: Path, prefix: str = "app") -> Dict[str, List[Dict[str, str]]]:
+    src_dir = Path(src_dir).resolve()
     # package root is the repo root that contains the package dir
     pkg_root = src_dir.parents[0]
     all_defs = collect_defs(src_dir, pkg_root)
@@ -213,9 +201,27 @@ def main() -> int:
             if a.startswith(prefix + ".") and b.startswith(prefix + "."):
                 edges.add((a, b))
 
-    payload = {"edges": [{"caller": a, "callee": b} for (a, b) in sorted(edges)]}
+    # edges are unique and sorted; consumers rely on the uniqueness
+    return {"edges": [{"caller": a, "callee": b} for (a, b) in sorted(edges)]}
+
+def main() -> int:
+    if len(sys.argv) < 2:
+        print("Usage: python tools/callgraph_ast.py <package_dir> [--out callgraph.json] [--prefix app]", file=sys.stderr)
+        return 2
+    src_dir = Path(sys.argv[1]).resolve()
+    out_path = Path("callgraph.json").resolve()
+    prefix = "app"
+    args = sys.argv[2:]
+    if "--out" in args:
+        i = args.index("--out")
+        out_path = Path(args[i+1]).resolve()
+    if "--prefix" in args:
+        i = args.index("--prefix")
+        prefix = args[i+1]
+
+    payload = build_callgraph(src_dir, prefix)
     out_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
-    print(f"[callgraph_ast] Wrote {len(edges)} edges to {out_path}", file=sys.stderr)
+    print(f"[callgraph_ast] Wrote {len(payload['edges'])} edges to {out_path}", file=sys.stderr)
     return 0
 
 if __name__ == "__main__":
@@ -124,24 +124,35 @@ def route_info(r: APIRoute) -> Dict:
             "error": "route_info_failed",
         }
 
+# Load the app and extract its routes
+def build_routes(app_spec: str) -> List[Dict]:
+    app = load_app(app_spec)
+
+    # build routes with stdout/stderr silenced as well (in case handlers print on inspection)
+    buff_out, buff_err = StringIO(), StringIO()
+    with redirect_stdout(buff_out), redirect_stderr(buff_err):
+        return [route_info(r) for r in app.routes if isinstance(r, APIRoute)]
+
 def main(argv: List[str]) -> int:
     out_path: Path | None = None
+    to_stdout = False
     for i, a in enumerate(argv):
         if a == "--out" and i + 1 < len(argv):
-            out_path = Path(argv[i + 1])
+            # "--out -" writes the JSON to stdout instead of a file
+            to_stdout = argv[i + 1] == "-"
+            out_path = None if to_stdout else Path(argv[i + 1])
 
     app_spec = os.getenv("APP_MODULE")
     if not app_spec:
         die("[export_routes] APP_MODULE is not set (e.g., 'app.main:app'). Set it and retry.", 3)
 
-    app = load_app(app_spec)
-
-    # build routes with stdout/stderr silenced as well (in case handlers print on inspection)
-    buff_out, buff_err = StringIO(), StringIO()
-    with redirect_stdout(buff_out), redirect_stderr(buff_err):
-        routes = [route_info(r) for r in app.routes if isinstance(r, APIRoute)]
+    routes = build_routes(app_spec)
 
     payload = json.dumps(routes, indent=2)
+    if to_stdout:
+        sys.stdout.write(payload)
+        print(f"[export_routes] Wrote {len(routes)} routes to stdout", file=sys.stderr)
+        return 0
     out_path = out_path or (ROOT / "routes.json")
     out_path.write_text(payload, encoding="utf-8")
     print(f"[export_routes] Wrote {len(routes)} routes to {out_path}", file=sys.stderr)
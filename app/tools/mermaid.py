@@ -3,13 +3,14 @@
 # Generate a Mermaid flowchart from FastAPI routes and a callgraph
 # ------------------------------------------------------------------------------
 
-import os, json, re
+import os, sys, io, json
 from pathlib import Path
-from collections import defaultdict, deque
+from functools import lru_cache
 
+# Input paths; ROUTES_JSON / CALLGRAPH_JSON let concurrent runs use their own files
 APP_ROOT = Path(__file__).resolve().parents[1]
-routes_path = APP_ROOT / "routes.json"
-callgraph_path = APP_ROOT / "callgraph.json"
+routes_path = Path(os.getenv("ROUTES_JSON") or (APP_ROOT / "routes.json"))
+callgraph_path = Path(os.getenv("CALLGRAPH_JSON") or (APP_ROOT / "callgraph.json"))
 
 # Layout/env controls
 MODE = os.getenv("MERMAID_MODE", "api")         # "api" | "nhops" | "full"
@@ -19,26 +20,67 @@ LABEL_MODE = os.getenv("LABEL_MODE", "short")   # "short" | "full"
 LABEL_DEPTH = int(os.getenv("LABEL_DEPTH", "2"))# used when LABEL_MODE="short"
 WRAP_BY_DOT = os.getenv("WRAP_BY_DOT", "1") == "1"
 
+# Edge lines per write() call in "full" mode
+EDGE_CHUNK = 4096
+
+# Memo size for the str -> str helpers below; bounded because pool workers are long-lived
+MEMO_SIZE = 1 << 16
+
+# Parse JSON bytes with orjson when available (much faster on large callgraphs)
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Read a JSON file as bytes, tolerating a UTF-8 BOM
+def _load_json(path: Path):
+    data = path.read_bytes()
+    if data.startswith(b"\xef\xbb\xbf"):
+        data = data[3:]
+    return _json_loads(data)
+
+# Class definitions written after the "flowchart <dir>" line
+_HEADER = (
+    "classDef endpoint fill:#eef,stroke:#88a,stroke-width:1px;\n"
+    "classDef handler  fill:#efe,stroke:#6a6,stroke-width:1px;\n"
+    "classDef data     fill:#fee,stroke:#c88,stroke-width:1px;\n"
+    "classDef tag      fill:#eee,stroke:#bbb,stroke-dasharray: 3 3;\n"
+    "classDef dep      fill:#fff4cc,stroke:#c7a84f,stroke-width:1px;\n"
+    "\n"
+    "%% Routes will be stacked vertically on the left\n"
+)
+
 # Load routes from routes.json
 def load_routes():
     if not routes_path.exists():
         return []
-    with routes_path.open(encoding="utf-8-sig") as f:
-        return json.load(f)
+    return _load_json(routes_path)
 
-# Load callgraph from callgraph.json
+# Load callgraph from callgraph.json. The file may be hand-edited, so repeated
+# edges are dropped here (in order, via dict.fromkeys) to keep the adjacency
+# lists in write_mermaid duplicate-free.
 def load_callgraph():
     if not callgraph_path.exists():
         return {"edges": []}
-    with callgraph_path.open(encoding="utf-8-sig") as f:
-        return json.load(f)
+    cg = _load_json(callgraph_path)
+    pairs = dict.fromkeys((e["caller"], e["callee"]) for e in cg.get("edges", []))
+    cg["edges"] = [{"caller": a, "callee": b} for a, b in pairs]
+    return cg
 
 # Helpers to make safe IDs and labels
-_id_re = re.compile(r'[^A-Za-z0-9_]')
+# Byte table mapping everything outside [A-Za-z0-9_] to "_" (non-ASCII chars
+# become "?" on encode, so they map to "_" too, one-for-one)
+_ID_TABLE = bytes(c if (48 <= c <= 57 or 65 <= c <= 90 or 97 <= c <= 122 or c == 95) else 95
+                  for c in range(256))
+@lru_cache(maxsize=MEMO_SIZE)
 def safe_id(s: str) -> str:
-    return _id_re.sub("_", s)
+    if s.isascii() and s.isidentifier():
+        return s  # plain names are already [A-Za-z0-9_]
+    return s.encode("ascii", "replace").translate(_ID_TABLE).decode("ascii")
 
 # Shorten a qualified name based on the label mode and depth
+@lru_cache(maxsize=MEMO_SIZE)
 def shorten_label(qualified: str) -> str:
     if LABEL_MODE == "short":
         parts = qualified.split(".")
@@ -53,116 +95,143 @@ def esc(s: str) -> str:
     return s.replace('"', '\\"')
 
 # Node IDs
+@lru_cache(maxsize=MEMO_SIZE)
 def fn_node(fn: str) -> str:
     return f"FN_{safe_id(fn)}"
 
 # Endpoint node IDs
+@lru_cache(maxsize=MEMO_SIZE)
 def ep_node(method: str, path: str) -> str:
     return f"EP_{safe_id(method + '_' + path)}"
 
-def main():
-    routes = load_routes()
-    cg = load_callgraph()
-    edges = cg.get("edges", [])
-
-    # Build adjacency for callgraph overlay
-    out_edges = defaultdict(set)
-    for e in edges:
-        out_edges[e["caller"]].add(e["callee"])
-
-    lines = []
-    lines += [
-        f"flowchart {DIR}",
-        "classDef endpoint fill:#eef,stroke:#88a,stroke-width:1px;",
-        "classDef handler  fill:#efe,stroke:#6a6,stroke-width:1px;",
-        "classDef data     fill:#fee,stroke:#c88,stroke-width:1px;",
-        "classDef tag      fill:#eee,stroke:#bbb,stroke-dasharray: 3 3;",
-        "classDef dep      fill:#fff4cc,stroke:#c7a84f,stroke-width:1px;",
-        "",
-        "%% Routes will be stacked vertically on the left"
-    ]
-
-    # 1) Tag nodes (one per tag)
-    tag_nodes = {}
-    for r in routes:
-        for t in (r.get("tags") or []):
-            if t not in tag_nodes:
-                tn = f"TAG_{safe_id(t)}"
-                lines.append(f'{tn}["tag: {esc(t)}"]:::tag')
-                tag_nodes[t] = tn
+# Per-render map of function name -> node id, filled on first lookup so each
+# unique name costs one fn_node() call and every later hit is a dict lookup
+class _NodeIds(dict):
+    def __missing__(self, fn: str) -> str:
+        node = self[fn] = fn_node(fn)
+        return node
+
+# Write routes + callgraph as Mermaid flowchart text, one batch per section, caller or edge chunk
+def write_mermaid(routes: list, callgraph: dict, write, mode: str = MODE,
+                  max_hops: int = MAX_HOPS, direction: str = DIR) -> None:
+    edges = callgraph.get("edges", [])
+
+    # Build adjacency for the handler-rooted overlays (edges are unique:
+    # callgraph_ast dedupes them and load_callgraph does the same for files,
+    # so plain lists are enough). "full" streams edges as-is and skips it.
+    out_edges = {}
+    if mode != "full":
+        for e in edges:
+            out_edges.setdefault(e["caller"], []).append(e["callee"])
 
-    # 2) Endpoints subgraph (vertical stack on the left)
-    #    Define endpoint nodes *inside* this subgraph so they stay together.
+    fn_ids = _NodeIds()
+
+    write(f"flowchart {direction}\n")
+    write(_HEADER)
+
+    # 1) Single pass over routes, collecting each section in output order:
+    #    tag nodes, endpoint nodes, handler nodes, and endpoint edges
+    tag_nodes = {}     # tag -> node id
+    tag_defs = []
     ep_defs = []
-    ep_nodes = []
-    handler_nodes = set()
     handler_defs = {}  # handler -> definition line (emit once)
+    ep_edges = []
+
+    # Bind hot callables to locals once, outside the loop
+    add_ep_def = ep_defs.append
+    add_ep_edge = ep_edges.append
+    _esc = esc
+    _ep_node = ep_node
 
     for r in routes:
         path = r["path"]
+        path_label = _esc(path)  # HTTP methods never contain quotes
+        handler = r["endpoint"]
+        hnode = fn_ids[handler]
+        tags = r.get("tags") or ()
+        if handler not in handler_defs:
+            handler_defs[handler] = f'{hnode}["{_esc(shorten_label(handler))}"]:::handler\n'
+        for t in tags:
+            if t not in tag_nodes:
+                tn = f"TAG_{safe_id(t)}"
+                tag_defs.append(f'{tn}["tag: {_esc(t)}"]:::tag\n')
+                tag_nodes[t] = tn
+        tag_ids = [tag_nodes[t] for t in tags]
         for m in r["methods"]:
-            ep = ep_node(m, path)
-            ep_nodes.append(ep)
-            ep_label = f"{m} {path}"
-            ep_defs.append(f'{ep}["{esc(ep_label)}"]:::endpoint')
-
-            handler = r["endpoint"]
-            hnode = fn_node(handler)
-            handler_nodes.add(handler)
-            if handler not in handler_defs:
-                h_label = shorten_label(handler)
-                handler_defs[handler] = f'{hnode}["{esc(h_label)}"]:::handler'
-
-    # Emit the routes column on the left
-    lines.append('subgraph ROUTES["Routes"]')
-    lines.append('direction TB')  # stack top-to-bottom
-    lines.extend(ep_defs)
-    lines.append('end')
+            ep = _ep_node(m, path)
+            add_ep_def(f'{ep}["{m} {path_label}"]:::endpoint\n')
+            add_ep_edge(f"{ep} --> {hnode}\n")
+            for tn in tag_ids:
+                add_ep_edge(f"{ep} --- {tn}\n")  # keep weak tie to tags
+
+    write("".join(tag_defs))
+
+    # 2) Endpoints subgraph (vertical stack on the left)
+    #    Define endpoint nodes *inside* this subgraph so they stay together.
+    write('subgraph ROUTES["Routes"]\n')
+    write('direction TB\n')  # stack top-to-bottom
+    write("".join(ep_defs))
+    write('end\n')
 
     # 3) Handlers (define once, outside the subgraph)
-    lines.append("\n%% Handlers")
-    lines.extend(handler_defs.values())
+    write("\n%% Handlers\n")
+    write("".join(handler_defs.values()))
 
     # 4) Edges: endpoints -> handlers, and tags to endpoints (dashed)
-    lines.append("\n%% Endpoint-to-handler edges")
-    for r in routes:
-        path = r["path"]
-        for m in r["methods"]:
-            ep = ep_node(m, path)
-            hnode = fn_node(r["endpoint"])
-            lines.append(f"{ep} --> {hnode}")
-            for t in (r.get("tags") or []):
-                lines.append(f"{ep} --- {tag_nodes[t]}")  # keep weak tie to tags
-
-    # 5) Callgraph overlay
-    def add_edge(u, v):
-        lines.append(f'{fn_node(u)} --> {fn_node(v)}')
-
-    if MODE == "api":
-        lines.append("\n%% Call graph from handlers (1 hop)")
+    write("\n%% Endpoint-to-handler edges\n")
+    write("".join(ep_edges))
+
+    # Handlers in first-seen route order, so the overlay below is deterministic
+    handler_nodes = list(handler_defs)
+
+    # 5) Callgraph overlay, written as one batch per caller
+    def add_edges(u, callees):
+        u_id = fn_ids[u]
+        write("".join([f"{u_id} --> {fn_ids[v]}\n" for v in callees]))
+
+    if mode == "api":
+        write("\n%% Call graph from handlers (1 hop)\n")
         for h in handler_nodes:
-            for d in out_edges.get(h, []):
-                add_edge(h, d)
-    elif MODE == "nhops":
-        lines.append(f"\n%% Call graph from handlers ({MAX_HOPS} hops)")
-        seen = set()
-        q = deque((h, 0) for h in handler_nodes)
-        while q:
-            cur, dist = q.popleft()
-            if dist >= MAX_HOPS:
-                continue
-            for nxt in out_edges.get(cur, []):
-                add_edge(cur, nxt)
-                key = (nxt, dist + 1)
-                if key not in seen:
-                    seen.add(key)
-                    q.append((nxt, dist + 1))
+            if h in out_edges:
+                add_edges(h, out_edges[h])
+    elif mode == "nhops":
+        write(f"\n%% Call graph from handlers ({max_hops} hops)\n")
+        # Level-by-level BFS: each node is expanded once, at its minimum
+        # distance, so every edge is emitted at most once. Frontiers are plain
+        # lists, so no (node, dist) tuple is allocated per visit.
+        seen = set(handler_nodes)
+        frontier = handler_nodes
+        for _ in range(max_hops):
+            next_frontier = []
+            for cur in frontier:
+                nexts = out_edges.get(cur)
+                if not nexts:
+                    continue
+                add_edges(cur, nexts)
+                for nxt in nexts:
+                    if nxt not in seen:
+                        seen.add(nxt)
+                        next_frontier.append(nxt)
+            if not next_frontier:
+                break
+            frontier = next_frontier
     else:  # full
-        lines.append("\n%% Full callgraph edges")
-        for e in edges:
-            add_edge(e["caller"], e["callee"])
+        write("\n%% Full callgraph edges\n")
+        # Written in fixed-size chunks so memory stays bounded on huge graphs
+        for i in range(0, len(edges), EDGE_CHUNK):
+            write("".join([f"{fn_ids[e['caller']]} --> {fn_ids[e['callee']]}\n"
+                           for e in edges[i:i + EDGE_CHUNK]]))
+
+# Render routes + callgraph as Mermaid flowchart text
+def render_mermaid(routes: list, callgraph: dict, mode: str = MODE,
+                   max_hops: int = MAX_HOPS, direction: str = DIR) -> str:
+    buf = io.StringIO()
+    write_mermaid(routes, callgraph, buf.write, mode=mode, max_hops=max_hops, direction=direction)
+    return buf.getvalue()
 
-    print("\n".join(lines))
+def main():
+    write_mermaid(load_routes(), load_callgraph(), sys.stdout.write)
+    sys.stdout.flush()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,86 @@
+// app/tools/mmdc_worker.mjs
+// ------------------------------------------------------------------------------
+// Long-lived Mermaid renderer: keeps one headless browser warm and answers
+// JSON-line requests on stdin ({id, definition}) with JSON-line SVG replies
+// Usage: node mmdc_worker.mjs [mermaid.config.json] [puppeteer.json]
+// ------------------------------------------------------------------------------
+
+import { createRequire } from "node:module";
+import { execSync } from "node:child_process";
+import { existsSync, readFileSync } from "node:fs";
+import { join } from "node:path";
+import { pathToFileURL } from "node:url";
+import readline from "node:readline";
+
+const CLI_PKG = "@mermaid-js/mermaid-cli";
+
+// stdout carries the protocol; keep stray logging off it
+console.log = console.error;
+
+// Read an optional JSON config file
+const readJson = (p) => (p && existsSync(p) ? JSON.parse(readFileSync(p, "utf8")) : {});
+
+// Locate the mermaid-cli package: MERMAID_CLI_DIR, local node_modules, then global npm root
+function findCliDir() {
+  const candidates = [];
+  if (process.env.MERMAID_CLI_DIR) candidates.push(process.env.MERMAID_CLI_DIR);
+  candidates.push(join(process.cwd(), "node_modules", CLI_PKG));
+  try {
+    candidates.push(join(execSync("npm root -g", { encoding: "utf8" }).trim(), CLI_PKG));
+  } catch {}
+  const dir = candidates.find((d) => existsSync(join(d, "package.json")));
+  if (!dir) throw new Error(`${CLI_PKG} not found. Install with: npm i -g ${CLI_PKG}`);
+  return dir;
+}
+
+// Resolve the package's ESM entry point from its package.json
+function entryOf(dir) {
+  const pkg = JSON.parse(readFileSync(join(dir, "package.json"), "utf8"));
+  let entry = pkg.exports;
+  if (entry && typeof entry === "object") entry = entry["."] ?? entry;
+  if (entry && typeof entry === "object") entry = entry.import ?? entry.default;
+  return join(dir, typeof entry === "string" ? entry : pkg.main || "src/index.js");
+}
+
+const reply = (msg) => process.stdout.write(JSON.stringify(msg) + "\n");
+
+const [mermaidConfigPath, puppeteerConfigPath] = process.argv.slice(2);
+const mermaidConfig = readJson(mermaidConfigPath);
+
+const cliDir = findCliDir();
+const { renderMermaid } = await import(pathToFileURL(entryOf(cliDir)).href);
+const pptr = createRequire(join(cliDir, "package.json"))("puppeteer");
+const puppeteer = pptr.launch ? pptr : pptr.default;
+const browser = await puppeteer.launch({ headless: true, ...readJson(puppeteerConfigPath) });
+
+// Render one request line and reply with the SVG or the error message
+async function handle(line) {
+  let id = null;
+  try {
+    const req = JSON.parse(line);
+    id = req.id;
+    const { data } = await renderMermaid(browser, req.definition, "svg", {
+      viewport: { width: 800, height: 600, deviceScaleFactor: req.scale ?? 1 },
+      backgroundColor: req.backgroundColor ?? "transparent",
+      mermaidConfig,
+    });
+    reply({ id, svg: Buffer.from(data).toString("utf8") });
+  } catch (err) {
+    reply({ id, error: String(err?.message ?? err) });
+  }
+}
+
+// Requests are handled concurrently; each render opens its own page
+const inflight = new Set();
+const rl = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+rl.on("line", (line) => {
+  const job = handle(line).finally(() => inflight.delete(job));
+  inflight.add(job);
+});
+rl.on("close", async () => {
+  await Promise.allSettled(inflight);
+  await browser.close();
+  process.exit(0);
+});
+
+reply({ ready: true });